@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared, typed access to the all.ctrl settings.
+
+The raw key=value parser used to be duplicated verbatim in dataset_calc.py,
+load_balancer.py and monitor_and_resubmit.py and ran at import time. It now
+lives here once; load() parses the file a single time per process (cached via
+lru_cache) and hands back an immutable Config whose fields already carry the
+right types, so callers never re-coerce strings on the hot path.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Tuple
+
+# Default control file, kept at the repository root.
+CONFIG_FILE = "all.ctrl"
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """
+    Immutable, typed view of the all.ctrl parameters.
+
+    Frozen so a Config can be shared freely across worker processes, and
+    slotted so attribute access is a C-level slot lookup rather than a dict
+    probe.
+
+    Attributes:
+        smiles_file (str): Path to the newline-separated SMILES input file.
+        num_mols (int): Total number of molecules to be processed.
+        receptor_location (str): Path to the receptor PDBQT file.
+        exhaustiveness (int): Exhaustiveness setting for the docking search.
+        center (Tuple[float, float, float]): Docking box center (x, y, z).
+        box_size (Tuple[float, float, float]): Docking box dimensions (x, y, z).
+        max_num_jobs (int): Number of Slurm array tasks for the screen.
+        use_load_balancer (bool): Whether to partition by atom count.
+        docking_score_threshold (float): Poses scoring at or below this value
+            are kept; everything else is pruned to conserve space.
+        use_prefilter (bool): Whether to skip docking for molecules outside
+            the Lipinski-style descriptor bounds below.
+        prefilter_max_mol_wt (float): Upper bound on molecular weight.
+        prefilter_max_logp (float): Upper bound on Crippen logP.
+        prefilter_max_hbd (int): Upper bound on hydrogen-bond donors.
+        prefilter_max_hba (int): Upper bound on hydrogen-bond acceptors.
+        prefilter_max_rot_bonds (int): Upper bound on rotatable bonds.
+        docking_method (str): Docking engine, 'vina' (CPU bindings),
+            'adgpu' (batched AutoDock-GPU), or 'multi-qvina' (batched
+            multi-QuickVina subprocess).
+        adgpu_executable (str): Path to the AutoDock-GPU binary.
+        adgpu_fld_file (str): AutoGrid .fld grid field file for the receptor.
+        adgpu_nrun (int): Number of LGA runs per ligand for AutoDock-GPU.
+        adgpu_batch_size (int): Ligands docked per AutoDock-GPU invocation.
+        mqvina_executable (str): Path to the multi-QuickVina binary.
+        mqvina_batch_size (int): Ligands docked per multi-QuickVina invocation.
+    """
+    smiles_file: str
+    num_mols: int
+    receptor_location: str
+    exhaustiveness: int
+    center: Tuple[float, float, float]
+    box_size: Tuple[float, float, float]
+    max_num_jobs: int
+    use_load_balancer: bool
+    docking_score_threshold: float
+    use_prefilter: bool
+    prefilter_max_mol_wt: float
+    prefilter_max_logp: float
+    prefilter_max_hbd: int
+    prefilter_max_hba: int
+    prefilter_max_rot_bonds: int
+    docking_method: str
+    adgpu_executable: str
+    adgpu_fld_file: str
+    adgpu_nrun: int
+    adgpu_batch_size: int
+    mqvina_executable: str
+    mqvina_batch_size: int
+
+
+def read_config_file(filename):
+    """
+    Reads configuration settings from a file and returns them as a dictionary.
+
+    This function opens a specified configuration file and reads its contents line by line.
+    Lines starting with a '#' are considered comments and are ignored, as are empty lines.
+    Each valid line is expected to be in the format 'key=value'. If the 'value' is a digit,
+    it is converted to an integer; otherwise, it is kept as a string.
+
+    Parameters:
+        filename (str): The path to the configuration file to be read.
+
+    Returns:
+        dict: A dictionary containing key-value pairs of configuration settings.
+              Keys are the configuration parameter names and values are the corresponding settings.
+
+    Example:
+        Assume we have a config.txt with the following content:
+            # Configuration for system
+            NUM_CPUs=10
+            USE_LOAD_BALANCER=True
+
+        Calling read_config_file("config.txt") will return:
+            {'NUM_CPUs': 10, 'USE_LOAD_BALANCER': 'True'}
+    """
+    params = {}
+    with open(filename, "r") as f:
+        lines = f.readlines()
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith("#"):  # skip comments and empty lines
+                key, value = line.split("=", 1)
+                if value.isdigit():
+                    params[key] = int(value)
+                else:
+                    params[key] = value
+    return params
+
+
+@lru_cache(maxsize=1)
+def load(filename: str = CONFIG_FILE) -> Config:
+    """
+    Parses the control file once per process and returns the cached Config.
+
+    Parameters:
+        filename (str): The path to the control file, defaults to all.ctrl.
+
+    Returns:
+        Config: The typed, immutable configuration.
+
+    Example:
+        >>> cfg = load()
+        >>> cfg.exhaustiveness
+        1
+    """
+    params = read_config_file(filename)
+    return Config(
+        smiles_file=str(params.get("SMILES_FILES")),
+        num_mols=int(params.get("NUM_MOLS", 0)),
+        receptor_location=str(params.get("RECEPTOR_LOCATION", "./DATA/docking_receptor.pdbqt")),
+        exhaustiveness=int(params.get("EXHAUSTIVENESS", 1)),
+        center=(float(params.get("CENTER_X")),
+                float(params.get("CENTER_Y")),
+                float(params.get("CENTER_Z"))),
+        box_size=(float(params.get("SIZE_X")),
+                  float(params.get("SIZE_Y")),
+                  float(params.get("SIZE_Z"))),
+        max_num_jobs=int(params.get("MAX_NUM_JOBS", 1)),
+        use_load_balancer=str(params.get("USE_LOAD_BALANCER", "True")) == "True",
+        docking_score_threshold=float(params.get("DOCKING_SCORE_THRESHOLD")),
+        use_prefilter=str(params.get("USE_PREFILTER", "False")) == "True",
+        prefilter_max_mol_wt=float(params.get("PREFILTER_MAX_MOL_WT", 500)),
+        prefilter_max_logp=float(params.get("PREFILTER_MAX_LOGP", 5)),
+        prefilter_max_hbd=int(params.get("PREFILTER_MAX_HBD", 5)),
+        prefilter_max_hba=int(params.get("PREFILTER_MAX_HBA", 10)),
+        prefilter_max_rot_bonds=int(params.get("PREFILTER_MAX_ROT_BONDS", 10)),
+        docking_method=str(params.get("DOCKING_METHOD", "vina")),
+        adgpu_executable=str(params.get("ADGPU_EXECUTABLE", "./DATA/autodock_gpu_128wi")),
+        adgpu_fld_file=str(params.get("ADGPU_FLD_FILE", "./DATA/maps/rec.maps.fld")),
+        adgpu_nrun=int(params.get("ADGPU_NRUN", 10)),
+        adgpu_batch_size=int(params.get("ADGPU_BATCH_SIZE", 1000)),
+        mqvina_executable=str(params.get("MQVINA_EXECUTABLE", "./DATA/multi-qvina")),
+        mqvina_batch_size=int(params.get("MQVINA_BATCH_SIZE", 100)),
+    )
@@ -6,63 +6,78 @@ Created on Mon Mar 27 14:46:58 2023
 @author: akshat
 """
 
-import os 
+import os
+import sys
+import glob
 import uuid
 import time
-import subprocess
+import shutil
+import sqlite3
 import argparse
-import multiprocessing    
-
-def read_config_file(filename):
+import subprocess
+import multiprocessing
+import config
+from rdkit import Chem
+from rdkit.Chem import AllChem, Crippen, Descriptors, Lipinski
+from meeko import MoleculePreparation, PDBQTWriterLegacy
+try:
+    from vina import Vina
+except ImportError:
+    # The bindings are only required by the 'vina' engine; the multi-qvina
+    # and adgpu paths exist precisely for clusters that cannot install them.
+    Vina = None
+
+# Prefix under which load_balancer.py caches the receptor's affinity grid
+# maps. Every worker in every Slurm array task reuses these instead of
+# recomputing identical grids for the same receptor and box.
+MAPS_PREFIX = './DATA/maps/rec'
+
+# Shared results database. All workers across all Slurm array tasks insert
+# into this one file; WAL mode lets concurrent writers coexist safely, and an
+# interrupted screen can be resumed by diffing the input SMILES against it.
+RESULTS_DB = './results.db'
+
+# Per-worker Vina instance, created once by _init_worker so that the receptor
+# grid maps are set up a single time per process instead of once per ligand.
+_VINA = None
+
+# Per-worker SQLite connection, opened once by _init_worker rather than per
+# molecule so each result costs a single INSERT instead of an open/close pair.
+_DB = None
+
+# Per-worker copy of the configuration. The parent parses all.ctrl exactly
+# once and hands the Config down through the pool initializer, so workers
+# never re-read the control file even under the 'spawn' start method.
+_CFG = None
+
+def _init_worker(cfg):
     """
-    Reads configuration settings from a file and returns them as a dictionary.
-    
-    This function opens a specified configuration file and reads its contents line by line.
-    Lines starting with a '#' are considered comments and are ignored, as are empty lines.
-    Each valid line is expected to be in the format 'key=value'. If the 'value' is a digit,
-    it is converted to an integer; otherwise, it is kept as a string.
+    Initializes a worker process for the multiprocessing pool.
 
-    Parameters:
-        filename (str): The path to the configuration file to be read.
+    Constructs a single Vina instance and loads the receptor. The affinity
+    grid maps are loaded from the on-disk cache written by load_balancer.py
+    (the map files are shared through the OS page cache across workers on a
+    node); if the cache is missing, they are computed from scratch. The
+    instance is stored in the module-global `_VINA` so that every ligand
+    docked by this worker reuses the same receptor maps. A single SQLite
+    connection to the shared results database is opened here as well.
 
-    Returns:
-        dict: A dictionary containing key-value pairs of configuration settings.
-              Keys are the configuration parameter names and values are the corresponding settings.
+    Parameters:
+        cfg (config.Config): Configuration parsed once in the parent and
+                             broadcast through the pool's initargs.
+    """
+    global _VINA, _DB, _CFG
+    _CFG = cfg
 
-    Example:
-        Assume we have a config.txt with the following content:
-            # Configuration for system
-            NUM_CPUs=10
-            USE_LOAD_BALANCER=True
+    _DB = sqlite3.connect(RESULTS_DB, isolation_level=None, timeout=60)
+    _DB.execute('PRAGMA journal_mode=WAL')
 
-        Calling read_config_file("config.txt") will return:
-            {'NUM_CPUs': 10, 'USE_LOAD_BALANCER': 'True'}
-    """
-    params = {}
-    with open(filename, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith("#"):  # skip comments and empty lines
-                key, value = line.split("=", 1)
-                if value.isdigit():
-                    params[key] = int(value)
-                else:
-                    params[key] = value
-    return params
-
-# Read the all.ctrl file to get parameters
-config_params = read_config_file("all.ctrl")
-
-RECEPTOR_LOCATION  = config_params.get("RECEPTOR_LOCATION", "./DATA/docking_receptor.pdbqt")
-EXHAUSTIVENESS     = str( config_params.get("EXHAUSTIVENESS", "1"))
-CENTER_X           = str( config_params.get("CENTER_X"))
-CENTER_Y           = str( config_params.get("CENTER_Y"))
-CENTER_Z           = str( config_params.get("CENTER_Z"))
-SIZE_X             = str( config_params.get("SIZE_X"))
-SIZE_Y             = str( config_params.get("SIZE_Y"))
-SIZE_Z             = str( config_params.get("SIZE_Z"))
-DOCKING_SCORE_THRS = float(config_params.get("DOCKING_SCORE_THRESHOLD"))
+    _VINA = Vina(sf_name='vina', cpu=1, verbosity=0)
+    _VINA.set_receptor(cfg.receptor_location)
+    if glob.glob(MAPS_PREFIX + '*.map'):
+        _VINA.load_maps(MAPS_PREFIX)
+    else:
+        _VINA.compute_vina_maps(center=list(cfg.center), box_size=list(cfg.box_size))
 
 def generate_unique_file_name(base_name, extension):
     """
@@ -85,74 +100,357 @@ def generate_unique_file_name(base_name, extension):
     return file_name
 
 
-def check_energy(lig_): 
+def check_energy(mol):
     """
-    Computes the total energy of a ligand using the Open Babel 'obenergy' tool.
+    Computes the total UFF energy of an embedded molecule with RDKit.
 
     Parameters:
-        lig_ (str): The file name of the ligand in PDBQT format.
+        mol (rdkit.Chem.Mol): A molecule with an embedded 3D conformer.
 
     Returns:
         float: The computed total energy of the ligand in kcal/mol. Returns 10000 if the calculation fails.
 
     Example:
-        >>> check_energy('ligand.pdbqt')
+        >>> check_energy(mol)
         -7.5
     """
     # Check the quality of generated structure (some post-processing quality control):
-    try: 
-        ob_cmd = ['obenergy', lig_]
-        command_obabel_check = subprocess.run(ob_cmd, capture_output=True)
-        command_obabel_check = command_obabel_check.stdout.decode("utf-8").split('\n')[-2]
-        total_energy         = float(command_obabel_check.split(' ')[-2])
-    except: 
-        total_energy = 10000 # Calculation has failed. 
-        
+    try:
+        ff           = AllChem.UFFGetMoleculeForceField(mol)
+        total_energy = ff.CalcEnergy()
+    except:
+        total_energy = 10000 # Calculation has failed.
+
     return total_energy
 
 
-def run_docking(lig_location, out_location, method='qvina'):
+def passes_prefilter(mol, cfg):
     """
-    Perform molecular docking using QuickVina or Smina specified by the method parameter.
+    Applies a cheap Lipinski-style descriptor screen ahead of docking.
+
+    Docking a single molecule costs seconds to minutes, while these RDKit
+    descriptors cost microseconds; molecules outside the configured bounds
+    are trivially outside the affinity regime of interest and are skipped
+    entirely.
 
     Parameters:
-        lig_location (str): The file path to the ligand file.
-        out_location (str): The file path where the output should be written.
-        method (str, optional): Specifies the docking method, defaults to 'qvina'.
+        mol (rdkit.Chem.Mol): The parsed molecule.
+        cfg (config.Config): Configuration carrying the descriptor bounds.
 
     Returns:
-        float: The best docking score obtained from the docking simulation.
+        tuple: (True, '') if the molecule should be docked, otherwise
+               (False, reason) naming the violated bound.
+
+    Example:
+        >>> passes_prefilter(Chem.MolFromSmiles('CCO'), config.load())
+        (True, '')
+    """
+    mol_wt = Descriptors.MolWt(mol)
+    if mol_wt > cfg.prefilter_max_mol_wt:
+        return False, 'MolWt {:.1f} > {}'.format(mol_wt, cfg.prefilter_max_mol_wt)
+    logp = Crippen.MolLogP(mol)
+    if logp > cfg.prefilter_max_logp:
+        return False, 'LogP {:.2f} > {}'.format(logp, cfg.prefilter_max_logp)
+    hbd = Lipinski.NumHDonors(mol)
+    if hbd > cfg.prefilter_max_hbd:
+        return False, 'HBD {} > {}'.format(hbd, cfg.prefilter_max_hbd)
+    hba = Lipinski.NumHAcceptors(mol)
+    if hba > cfg.prefilter_max_hba:
+        return False, 'HBA {} > {}'.format(hba, cfg.prefilter_max_hba)
+    rot = Lipinski.NumRotatableBonds(mol)
+    if rot > cfg.prefilter_max_rot_bonds:
+        return False, 'RotBonds {} > {}'.format(rot, cfg.prefilter_max_rot_bonds)
+
+    return True, ''
+
+
+def run_docking(lig_pdbqt, method='vina'):
+    """
+    Perform molecular docking using the AutoDock-Vina Python bindings.
+
+    The ligand is docked against the receptor maps held by this worker's
+    shared Vina instance (see _init_worker), so no external process is
+    spawned and the receptor grids are never recomputed per molecule. The
+    best pose is returned as a PDBQT string rather than written to disk, so
+    callers only pay for file I/O on molecules they actually want to keep.
+
+    Parameters:
+        lig_pdbqt (str): The ligand structure as a PDBQT-format string.
+        method (str, optional): Specifies the docking method, defaults to 'vina'.
+
+    Returns:
+        tuple: The best docking score and the corresponding pose as a
+               PDBQT-format string.
 
     Raises:
         ValueError: If an unsupported method is specified.
-        subprocess.CalledProcessError: If the docking process fails.
 
     Example:
-        >>> run_docking('ligand.pdbqt', 'output.pdbqt')
-        -9.2
+        >>> score, pose_pdbqt = run_docking(ligand_pdbqt_string)
     """
-    if method == 'qvina':
-        command_run = subprocess.run(["./DATA/qvina", "--receptor", RECEPTOR_LOCATION, "--ligand", lig_location, "--center_x", CENTER_X, "--center_y", CENTER_Y, "--center_z", CENTER_Z, "--size_x", SIZE_X, "--size_y", SIZE_Y, "--size_z", SIZE_Z, "--exhaustiveness", EXHAUSTIVENESS, "--out", out_location], capture_output=True)
+    if method == 'vina':
+        _VINA.set_ligand_from_string(lig_pdbqt)
+        _VINA.dock(exhaustiveness=_CFG.exhaustiveness, n_poses=1)
+        docking_score = float(_VINA.energies(n_poses=1)[0][0])
+        pose_pdbqt    = _VINA.poses(n_poses=1)
     else:
-        raise ValueError('Unsupported docking method specified. Only "qvina" or "smina" are supported.')
+        raise ValueError('Unsupported docking method specified. Only "vina" is supported.')
 
-    # Check the quality of the output pose:
-    pose_energy = check_energy(out_location)
-    if pose_energy == 10000:
-        return 10000  # Indicates a failed docking process with a placeholder error value.
+    return docking_score, pose_pdbqt
+
+
+def _init_prep_worker(cfg):
+    """
+    Initializes a worker process for the ligand-preparation-only pool.
 
-    # Extract and return the best docking score:
-    docking_score = float('inf')
-    for line in command_run.stdout.decode("utf-8").split('\n'):
+    Used by the batch engines, where workers only parse, filter, and embed
+    ligands (the docking itself runs batched elsewhere), so no Vina instance
+    is needed -- just the configuration and the shared results-database
+    connection.
+
+    Parameters:
+        cfg (config.Config): Configuration parsed once in the parent and
+                             broadcast through the pool's initargs.
+    """
+    global _DB, _CFG
+    _CFG = cfg
+    _DB = sqlite3.connect(RESULTS_DB, isolation_level=None, timeout=60)
+    _DB.execute('PRAGMA journal_mode=WAL')
+
+
+def prepare_ligand_file(args):
+    """
+    Prepares a single SMILES string as an on-disk PDBQT ligand file.
+
+    Runs the same prefilter, ETKDG embedding, and stability check as the
+    CPU path, but writes the ligand PDBQT to disk because batch engines
+    such as AutoDock-GPU consume ligand files rather than strings.
+    Prefiltered and failed molecules are recorded in the results database
+    immediately so only dockable ligands reach the GPU.
+
+    Parameters:
+        args (tuple): A tuple containing a SMILES string and its job index.
+
+    Returns:
+        tuple: (smi, path) of the written ligand file, or (smi, None) if the
+               molecule was prefiltered or could not be prepared.
+    """
+    smi, job_idx = args
+    try:
+        mol = Chem.MolFromSmiles(smi)
+
+        cfg = _CFG
+        if cfg.use_prefilter:
+            ok, reason = passes_prefilter(mol, cfg)
+            if not ok:
+                _DB.execute('INSERT OR REPLACE INTO prefiltered(smi, reason) VALUES (?, ?)',
+                            (smi.strip(), reason))
+                return smi, None
+
+        mol = Chem.AddHs(mol)
+        AllChem.EmbedMolecule(mol, AllChem.ETKDGv3())
+        AllChem.MMFFOptimizeMolecule(mol, maxIters=200)
+
+        if check_energy(mol) >= 10000:
+            raise ValueError('Unstable geometry')
+
+        preparator = MoleculePreparation()
+        setups     = preparator.prepare(mol)
+        lig_pdbqt  = PDBQTWriterLegacy.write_string(setups[0])[0]
+
+        lig_location = generate_unique_file_name('lig', 'pdbqt')
+        with open(lig_location, 'w') as f:
+            f.write(lig_pdbqt)
+        return smi, lig_location
+
+    except: # For preparation failure cases
+        _DB.execute('INSERT OR REPLACE INTO scores(smi, score, job) VALUES (?, ?, ?)',
+                    (smi.strip(), 10000, job_idx))
+        return smi, None
+
+
+def _best_dlg_energy(dlg_location):
+    """
+    Extracts the best binding energy from an AutoDock-GPU .dlg output file.
+
+    Parameters:
+        dlg_location (str): Path to the .dlg file written by AutoDock-GPU.
+
+    Returns:
+        float: The lowest binding energy over all ranked runs, in kcal/mol.
+               Returns 10000 if the file is missing or cannot be parsed.
+    """
+    best_energy = float('inf')
+    try:
+        with open(dlg_location, 'r') as f:
+            for line in f:
+                parts = line.split()
+                # RANKING table rows: rank, sub-rank, run, binding energy, ...
+                if len(parts) >= 4 and parts[0].isdigit() and 'RANKING' in line:
+                    best_energy = min(best_energy, float(parts[3]))
+    except:
+        return 10000
+
+    return best_energy if best_energy != float('inf') else 10000
+
+
+def run_docking_batch_adgpu(batch, job_idx, conn):
+    """
+    Docks a batch of prepared ligand PDBQT files with AutoDock-GPU.
+
+    A single AutoDock-GPU invocation processes the whole batch via its
+    --filelist interface, amortizing engine startup and grid upload across
+    all ligands in the chunk. Scores are parsed from the per-ligand .dlg
+    files and recorded in the shared results database; the intermediate
+    ligand and .dlg files are removed afterwards.
+
+    Parameters:
+        batch (list): (smi, ligand file path) tuples from prepare_ligand_file.
+        job_idx (int): The index of the job, used for output differentiation.
+        conn (sqlite3.Connection): Open connection to the results database.
+    """
+    cfg = config.load()
+
+    filelist_location = generate_unique_file_name('adgpu_filelist', 'txt')
+    with open(filelist_location, 'w') as f:
+        f.write(cfg.adgpu_fld_file + '\n')
+        for _, lig_location in batch:
+            f.write(lig_location + '\n')
+
+    subprocess.run([cfg.adgpu_executable, '--filelist', filelist_location,
+                    '--nrun', str(cfg.adgpu_nrun)],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.unlink(filelist_location)
+
+    for smi, lig_location in batch:
+        dlg_location = os.path.splitext(lig_location)[0] + '.dlg'
+        docking_score = _best_dlg_energy(dlg_location)
+        conn.execute('INSERT OR REPLACE INTO scores(smi, score, job) VALUES (?, ?, ?)',
+                     (smi.strip(), docking_score, job_idx))
+        for leftover in (lig_location, dlg_location):
+            try:
+                os.unlink(leftover)
+            except FileNotFoundError:
+                pass
+
+
+def run_docking_batch_mqvina(batch, job_idx, conn):
+    """
+    Docks a batch of prepared ligand PDBQT files with multi-QuickVina.
+
+    The batch's ligand PDBQTs are concatenated and piped into a single
+    multi-QuickVina invocation, so the receptor load and grid precompute
+    are paid once per batch rather than once per molecule. Best scores are
+    parsed from the combined result tables in one pass and recorded in the
+    shared results database; the intermediate files are removed afterwards.
+
+    Parameters:
+        batch (list): (smi, ligand file path) tuples from prepare_ligand_file.
+        job_idx (int): The index of the job, used for output differentiation.
+        conn (sqlite3.Connection): Open connection to the results database.
+    """
+    cfg = config.load()
+
+    conf_location = generate_unique_file_name('mqvina_conf', 'txt')
+    with open(conf_location, 'w') as f:
+        f.write('center_x = {}\ncenter_y = {}\ncenter_z = {}\n'.format(*cfg.center))
+        f.write('size_x = {}\nsize_y = {}\nsize_z = {}\n'.format(*cfg.box_size))
+        f.write('exhaustiveness = {}\n'.format(cfg.exhaustiveness))
+
+    # Concatenate the batch's conformers into one stream for stdin:
+    batched_location = generate_unique_file_name('mqvina_batch', 'pdbqt')
+    with open(batched_location, 'wb') as dst:
+        for _, lig_location in batch:
+            with open(lig_location, 'rb') as src:
+                shutil.copyfileobj(src, dst)
+
+    with open(batched_location, 'r') as batched:
+        result = subprocess.run([cfg.mqvina_executable, '--receptor', cfg.receptor_location,
+                                 '--config', conf_location],
+                                stdin=batched, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True)
+
+    # The combined output holds one result table per ligand, in input
+    # order; the first data row of each table (mode 1) carries its best
+    # affinity.
+    best_scores = []
+    for line in result.stdout.split('\n'):
         parts = line.strip().split()
-        if len(parts) == 4 and parts[0].isdigit():
-            score = float(parts[1])
-            docking_score = min(docking_score, score)
-    
-    return docking_score
+        if len(parts) == 4 and parts[0] == '1':
+            best_scores.append(float(parts[1]))
+
+    # Scores are matched to molecules by position, which is only sound if
+    # the engine emitted exactly one table per ligand. If it skipped or
+    # errored on one mid-batch, every later score would silently land on
+    # its neighbor, so record the whole batch as failed instead of
+    # committing misaligned values.
+    if len(best_scores) != len(batch):
+        print('multi-qvina returned {} result tables for a batch of {}; '
+              'recording the batch as failed.'.format(len(best_scores), len(batch)))
+        best_scores = [10000] * len(batch)
+
+    for (smi, lig_location), docking_score in zip(batch, best_scores):
+        conn.execute('INSERT OR REPLACE INTO scores(smi, score, job) VALUES (?, ?, ?)',
+                     (smi.strip(), docking_score, job_idx))
+        os.unlink(lig_location)
+    os.unlink(conf_location)
+    os.unlink(batched_location)
+
+
+def main_mqvina(data, job_idx):
+    """
+    Docks a partition of SMILES strings with multi-QuickVina.
+
+    Mirrors the AutoDock-GPU path: the CPU pool prepares ligand PDBQT files
+    and the docking runs one subprocess per batch, dividing the receptor
+    setup cost by the batch size. Intended for clusters where the Vina
+    Python bindings cannot be installed.
+
+    Parameters:
+        data (list): (smi, job_idx) tuples for the partition.
+        job_idx (int): The index of the job, used for output differentiation.
+    """
+    cfg = config.load()
+
+    with multiprocessing.Pool(os.cpu_count(), initializer=_init_prep_worker,
+                              initargs=(cfg,), maxtasksperchild=2000) as pool:
+        prepared = [item for item in pool.imap_unordered(prepare_ligand_file, data, chunksize=8)
+                    if item[1] is not None]
+
+    conn = sqlite3.connect(RESULTS_DB, isolation_level=None, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    for start in range(0, len(prepared), cfg.mqvina_batch_size):
+        run_docking_batch_mqvina(prepared[start:start + cfg.mqvina_batch_size], job_idx, conn)
+    conn.close()
 
 
-def perform_calc_single(args): 
+def main_adgpu(data, job_idx):
+    """
+    Docks a partition of SMILES strings with AutoDock-GPU.
+
+    The CPU pool only prepares ligand PDBQT files (parsing, prefiltering,
+    embedding); the docking itself runs in large batches on the GPU, where
+    AutoDock-GPU overlaps many ligands per invocation.
+
+    Parameters:
+        data (list): (smi, job_idx) tuples for the partition.
+        job_idx (int): The index of the job, used for output differentiation.
+    """
+    cfg = config.load()
+
+    with multiprocessing.Pool(os.cpu_count(), initializer=_init_prep_worker,
+                              initargs=(cfg,), maxtasksperchild=2000) as pool:
+        prepared = [item for item in pool.imap_unordered(prepare_ligand_file, data, chunksize=8)
+                    if item[1] is not None]
+
+    conn = sqlite3.connect(RESULTS_DB, isolation_level=None, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    for start in range(0, len(prepared), cfg.adgpu_batch_size):
+        run_docking_batch_adgpu(prepared[start:start + cfg.adgpu_batch_size], job_idx, conn)
+    conn.close()
+
+
+def perform_calc_single(args):
     """
     Processes a single SMILES string to generate a 3D structure, check its stability, and perform docking.
 
@@ -161,58 +459,63 @@ def perform_calc_single(args):
 
     Example:
         >>> perform_calc_single(('CCO', 0))
-        Writes results to output files and performs cleanup.
+        Records the score in the shared results database; pose/ligand files
+        are only created for molecules that pass the docking-score threshold.
 
     Note:
         This function assumes that necessary global variables and paths are correctly set.
     """
     out_location    = generate_unique_file_name('pose', 'pdbqt') # For the docking pose
-    output_filename = generate_unique_file_name('lig', 'pdbqt')  # For the 3D ligand (obabel converted smi)
-    
-    try: 
+    output_filename = generate_unique_file_name('lig', 'pdbqt')  # For the 3D ligand
+
+    try:
         smi, job_idx = args
-        cmd = ["obabel", "-ismi","-:" + smi,"-O", output_filename, "--gen3d", "fastest"]
-        # subprocess.run(cmd, timeout=120)
-        with open(os.devnull, 'w') as devnull:
-            subprocess.run(cmd, stdout=devnull, stderr=devnull, timeout=120)
 
-        # Ensure a stable molecule: 
-        lig_energy = check_energy(output_filename)
-    
-        # Specifying docking input file & output file: 
-        lig_location = output_filename
-        
-        # Perform docking: 
-        if lig_energy < 10000: 
-            docking_score = run_docking(lig_location, out_location, method='qvina')
-                
-        if docking_score > DOCKING_SCORE_THRS: 
-            if os.path.exists(out_location):
-                os.system('rm {}'.format(out_location))
-            if os.path.exists(output_filename):
-                os.system('rm {}'.format(output_filename))
-            with open('./OUTPUT_{}.txt'.format(job_idx), 'a+') as f: 
-                f.writelines(['{}, {}\n'.format(smi, docking_score)]) 
-        else: 
-            with open('./OUTPUT_{}.txt'.format(job_idx), 'a+') as f: 
-                f.writelines(['{}, {}\n'.format(smi, docking_score)]) 
-                
-            # Make the directory if it does not exist 
+        mol = Chem.MolFromSmiles(smi)
+
+        # Skip docking for molecules trivially outside the affinity regime;
+        # they are recorded separately so resubmissions do not rerun them.
+        cfg = _CFG
+        if cfg.use_prefilter:
+            ok, reason = passes_prefilter(mol, cfg)
+            if not ok:
+                _DB.execute('INSERT OR REPLACE INTO prefiltered(smi, reason) VALUES (?, ?)',
+                            (smi.strip(), reason))
+                return
+
+        # Build the 3D structure in-process with RDKit (ETKDG embedding
+        # followed by an MMFF cleanup) and write the PDBQT via Meeko:
+        mol = Chem.AddHs(mol)
+        AllChem.EmbedMolecule(mol, AllChem.ETKDGv3())
+        AllChem.MMFFOptimizeMolecule(mol, maxIters=200)
+
+        preparator = MoleculePreparation()
+        setups     = preparator.prepare(mol)
+        lig_pdbqt  = PDBQTWriterLegacy.write_string(setups[0])[0]
+
+        # Ensure a stable molecule:
+        lig_energy = check_energy(mol)
+
+        # Perform docking; ligand and pose stay in memory as PDBQT strings:
+        if lig_energy < 10000:
+            docking_score, pose_pdbqt = run_docking(lig_pdbqt, method='vina')
+
+        _DB.execute('INSERT OR REPLACE INTO scores(smi, score, job) VALUES (?, ?, ?)',
+                    (smi.strip(), docking_score, job_idx))
+
+        if docking_score <= cfg.docking_score_threshold:
+            # Promising molecule: materialize the ligand and pose files
+            # directly in OUTPUTS/. Pruned molecules never touch disk.
             os.makedirs("OUTPUTS", exist_ok=True)
-            
-            # Move the files lig_location, out_location to the directory OUTPUTS/ there is no need to keep the file in the original location anymore
-            os.system('mv {} OUTPUTS/'.format(lig_location))
-            os.system('mv {} OUTPUTS/'.format(out_location))
+            with open(os.path.join("OUTPUTS", output_filename), 'w') as f:
+                f.write(lig_pdbqt)
+            with open(os.path.join("OUTPUTS", out_location), 'w') as f:
+                f.write(pose_pdbqt)
 
-    except: # For docking failure cases 
+    except: # For docking failure cases
 
-        if os.path.exists(out_location):
-            os.system('rm {}'.format(out_location))
-        if os.path.exists(output_filename):
-            os.system('rm {}'.format(output_filename))
-        
-        with open('./OUTPUT_{}.txt'.format(job_idx), 'a+') as f: 
-            f.writelines(['{}, {}\n'.format(smi, 10000)]) 
+        _DB.execute('INSERT OR REPLACE INTO scores(smi, score, job) VALUES (?, ?, ?)',
+                    (smi.strip(), 10000, job_idx))
 
 
 def main(filename, job_idx):
@@ -229,34 +532,75 @@ def main(filename, job_idx):
         >>> main('smiles.txt', 1)
         Begins processing of SMILES strings and outputs results to designated files.
     """
-    smiles_all     = []
+    # Parse the configuration once here, in the parent; workers receive it
+    # through the pool initializers instead of re-reading all.ctrl.
+    cfg = config.load()
+
     with open(filename, 'r') as f:
-        smiles_all = f.readlines()
-    
+        smiles_all = f.read().splitlines()
+
     print('Num smiles:', len(smiles_all))
-    data = [(smiles, job_idx) for smiles in enumerate(smiles_all)]
-    
-    # pool object with number of element
-    pool = multiprocessing.Pool()
-    
-    # Parallel time: 
+    data = [(smiles, job_idx) for smiles in smiles_all]
+
+    # Make sure the shared results table exists before any worker connects:
+    conn = sqlite3.connect(RESULTS_DB, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS scores (smi TEXT PRIMARY KEY, score REAL, job INTEGER)')
+    conn.execute('CREATE TABLE IF NOT EXISTS prefiltered (smi TEXT PRIMARY KEY, reason TEXT)')
+    conn.close()
+
     start_time = time.time()
-    pool.map(perform_calc_single, data)
+    if cfg.docking_method == 'adgpu':
+        # GPU engine: CPUs only prepare ligands, AutoDock-GPU docks them in
+        # large batches.
+        main_adgpu(data, job_idx)
+    elif cfg.docking_method == 'multi-qvina':
+        # Batched subprocess engine for clusters without the Vina bindings.
+        main_mqvina(data, job_idx)
+    else:
+        # CPU engine. One worker per CPU; each worker sets up its Vina
+        # instance (receptor + grid maps) exactly once via the initializer
+        # and is recycled after a few thousand molecules so fragmentation
+        # cannot build up on long runs.
+        if Vina is None:
+            sys.exit('The vina Python bindings are not installed; install them or set '
+                     'DOCKING_METHOD=multi-qvina or adgpu in all.ctrl.')
+        pool = multiprocessing.Pool(os.cpu_count(), initializer=_init_worker,
+                                    initargs=(cfg,), maxtasksperchild=2000)
+
+        # imap_unordered streams results instead of buffering the whole
+        # list, and the small chunksize keeps workers evenly loaded on
+        # heterogeneous SMILES sizes:
+        for _ in pool.imap_unordered(perform_calc_single, data, chunksize=8):
+            pass
+        pool.close()
+        pool.join()
     total_time = time.time() - start_time
     print('Total Time: {}, Jobs Idx: {}'.format(total_time, job_idx))
     
         
     
     
-parser = argparse.ArgumentParser()
-parser.add_argument("job_id", help="Array ID: SLURM_ARRAY_TASK_ID")
-args = parser.parse_args()
-job_idx = int(args.job_id)    
-
-SMILES_FILE = './DATA/partition_{}.smi'.forma(job_idx)
-print('Operating on partition file: ', SMILES_FILE)
-
-main(SMILES_FILE, job_idx)
+if __name__ == '__main__':
+    # RDKit, Meeko, and the Vina bindings are imported at module scope
+    # above, so under the 'fork' start method every pool worker inherits
+    # the already-initialized interpreter copy-on-write instead of paying
+    # hundreds of milliseconds of import cost per process. Force 'fork'
+    # explicitly so an HPC scheduler defaulting to 'spawn' cannot take
+    # that away.
+    multiprocessing.set_start_method('fork', force=True)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job_id", help="Array ID: SLURM_ARRAY_TASK_ID")
+    args = parser.parse_args()
+    job_idx = int(args.job_id)
+
+    SMILES_FILE = f'./DATA/partition_{job_idx}.smi'
+    if not os.path.isfile(SMILES_FILE):
+        sys.exit(f'Missing partition file {SMILES_FILE}; run load_balancer.py first.')
+    print('Operating on partition file: ', SMILES_FILE)
+
+    main(SMILES_FILE, job_idx)
 
     
     
@@ -5,49 +5,52 @@ Created on Mon Jun  3 04:43:44 2024
 @author: aksha
 """
 import os
+import heapq
 import random
+import multiprocessing
+import numpy as np
+import config
 from rdkit import Chem
 from typing import List
-
-
-
-def read_config_file(filename):
+try:
+    from vina import Vina
+except ImportError:
+    # Grid maps are only cached for the 'vina' engine; clusters running
+    # multi-qvina or adgpu partition without the bindings installed.
+    Vina = None
+
+# Prefix under which the receptor's affinity grid maps are cached on disk.
+# Must match MAPS_PREFIX in dataset_calc.py, whose workers load these maps.
+MAPS_PREFIX = './DATA/maps/rec'
+
+def write_vina_maps(cfg: config.Config, maps_prefix: str = MAPS_PREFIX) -> None:
     """
-    Reads configuration settings from a file and returns them as a dictionary.
-    
-    This function opens a specified configuration file and reads its contents line by line.
-    Lines starting with a '#' are considered comments and are ignored, as are empty lines.
-    Each valid line is expected to be in the format 'key=value'. If the 'value' is a digit,
-    it is converted to an integer; otherwise, it is kept as a string.
+    Precomputes the receptor's affinity grid maps and caches them on disk.
 
-    Parameters:
-        filename (str): The path to the configuration file to be read.
+    The grid maps depend only on the receptor and the docking box, so they are
+    identical for every Slurm array task. This function builds them exactly
+    once at submission time and writes them under 'maps_prefix'; the workers
+    in dataset_calc.py then call Vina.load_maps() instead of recomputing the
+    same grids in every process of every job.
 
-    Returns:
-        dict: A dictionary containing key-value pairs of configuration settings.
-              Keys are the configuration parameter names and values are the corresponding settings.
-
-    Example:
-        Assume we have a config.txt with the following content:
-            # Configuration for system
-            NUM_CPUs=10
-            USE_LOAD_BALANCER=True
+    Parameters:
+        cfg (config.Config): Parsed all.ctrl settings, providing the receptor
+                             location and the docking box center/size.
+        maps_prefix (str): The file-name prefix under which the map files are
+                           written (one '<prefix>.<atom_type>.map' per type).
 
-        Calling read_config_file("config.txt") will return:
-            {'NUM_CPUs': 10, 'USE_LOAD_BALANCER': 'True'}
+    Raises:
+        ImportError: If the vina Python bindings are not installed.
     """
-    params = {}
-    with open(filename, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith("#"):  # skip comments and empty lines
-                key, value = line.split("=", 1)
-                if value.isdigit():
-                    params[key] = int(value)
-                else:
-                    params[key] = value
-    return params
+    if Vina is None:
+        raise ImportError('The vina Python bindings are required to cache grid maps; '
+                          'install them or set DOCKING_METHOD=multi-qvina or adgpu in all.ctrl.')
+    v = Vina(sf_name='vina', verbosity=0)
+    v.set_receptor(cfg.receptor_location)
+    v.compute_vina_maps(center=list(cfg.center), box_size=list(cfg.box_size))
+    os.makedirs(os.path.dirname(maps_prefix), exist_ok=True)
+    v.write_maps(maps_prefix)
+    print(f'Receptor grid maps cached under {maps_prefix}')
 
 def count_atoms(smiles: str) -> int:
     """
@@ -79,11 +82,13 @@ def load_balance_smiles(smiles_list: List[str], m: int) -> List[List[str]]:
     """
     Distributes SMILES strings into 'm' partitions to achieve a balanced computational load based on the number of atoms in each molecule.
     
-    The function first calculates the number of atoms for each molecule represented by a SMILES string. It then sorts these molecules
-    based on their atom counts in descending order. This sorted list ensures that molecules with the greatest computational demand 
-    are considered first. Using a greedy algorithm, the function allocates each molecule to the partition with the current lowest 
-    cumulative atomic count, thereby aiming for an even distribution of computational load across all partitions.
-    
+    The function first calculates the number of atoms for each molecule represented by a SMILES string into a NumPy array,
+    fanning the RDKit parses out across all available CPUs, and
+    orders the molecules by atom count in descending order with argsort. This sorted order ensures that molecules with the
+    greatest computational demand are considered first. Using a greedy algorithm, the function allocates each molecule to the
+    partition with the current lowest cumulative atomic count, tracked in a min-heap of (load, partition index) pairs so each
+    assignment costs O(log m) instead of a linear scan over all partitions.
+
     Parameters:
         smiles_list (List[str]): A list of SMILES strings representing the molecules to be distributed.
         m (int): The number of partitions into which the molecules should be distributed.
@@ -97,23 +102,29 @@ def load_balance_smiles(smiles_list: List[str], m: int) -> List[List[str]]:
         for i, partition in enumerate(partitions):
             print(f"Partition {i+1}: {partition}")
     """
-    # Calculate atoms for each molecule
-    molecules = [(smiles, count_atoms(smiles)) for smiles in smiles_list]
-    
-    # Sort molecules by number of atoms in descending order
-    molecules.sort(key=lambda x: x[1], reverse=True)
-    
-    # Initialize partitions and their load counts
+    # Calculate atoms for each molecule into a structure-of-arrays layout.
+    # The RDKit parses are independent and CPU-bound, so fan them out over
+    # all cores instead of parsing serially on one.
+    chunksize = max(1, len(smiles_list) // (os.cpu_count() * 4))
+    with multiprocessing.Pool() as pool:
+        atom_counts = np.array(pool.map(count_atoms, smiles_list, chunksize=chunksize),
+                               dtype=np.int32)
+
+    # Order molecules by number of atoms, descending
+    order = np.argsort(-atom_counts)
+
+    # Initialize partitions and a min-heap of (cumulative load, partition index)
     partitions = [[] for _ in range(m)]
-    partition_loads = [0] * m
-    
-    # Distribute molecules using a greedy approach
-    for smiles, atom_count in molecules:
-        # Find the partition with the minimum load
-        min_index = partition_loads.index(min(partition_loads))
-        partitions[min_index].append(smiles)
-        partition_loads[min_index] += atom_count
-    
+    heap = [(0, i) for i in range(m)]
+    heapq.heapify(heap)
+
+    # Distribute molecules using a greedy approach: always assign the next
+    # molecule to the currently least-loaded partition
+    for idx in order:
+        load, min_index = heapq.heappop(heap)
+        partitions[min_index].append(smiles_list[idx])
+        heapq.heappush(heap, (load + int(atom_counts[idx]), min_index))
+
     return partitions
 
 
@@ -151,29 +162,36 @@ def random_load_balance_smiles(smiles_list: List[str], m: int) -> List[List[str]
 
 if __name__ == '__main__':
     # Read configuration parameters from the control file
-    config_params = read_config_file("all.ctrl")
-
-    # Extract configuration settings
-    SMILES_FILE = str(config_params.get("SMILES_FILES"))
-    MAX_NUM_JOBS = int(config_params.get("MAX_NUM_JOBS"))
-    USE_LOAD_BALANCER = bool(config_params.get("USE_LOAD_BALANCER"))
+    cfg = config.load()
 
     # Read the SMILES data from the file specified in the configuration
-    with open(SMILES_FILE, 'r') as f:
+    with open(cfg.smiles_file, 'r') as f:
         smiles_data = f.readlines()
 
-    if USE_LOAD_BALANCER:
+    if cfg.use_load_balancer:
         # When load balancing is enabled, distribute SMILES strings to optimize computational load
         print('Partitioning based on the load balancer')
-        partitions = load_balance_smiles(smiles_data, MAX_NUM_JOBS)
+        partitions = load_balance_smiles(smiles_data, cfg.max_num_jobs)
     else:
         # When load balancing is not enabled, distribute SMILES strings randomly
         print('Partitioning WITHOUT a load balancer')
-        partitions = random_load_balance_smiles(smiles_data, MAX_NUM_JOBS)
-
-    # Output and save the results for each partition
+        partitions = random_load_balance_smiles(smiles_data, cfg.max_num_jobs)
+
+    # Output and save the results for each partition. The greedy fill leaves
+    # each partition in descending atom-count order, which front-loads every
+    # task with its hardest molecules; shuffling interleaves hard and easy
+    # ligands so workers stay evenly saturated. The fixed seed keeps the
+    # partition files reproducible across runs.
+    rng = random.Random(42)
     for i, partition in enumerate(partitions):
+        rng.shuffle(partition)
         partition_filename = f'./DATA/partition_{i+1}.smi'
         print(f"Partition {i+1}: len = {len(partition)}")
         with open(partition_filename, 'w') as f:
-            f.writelines(partition)
\ No newline at end of file
+            f.writelines(partition)
+
+    # Cache the receptor grid maps once so every array task can load them
+    # instead of recomputing identical grids. Only the 'vina' engine reads
+    # this cache; multi-qvina and adgpu bring their own grid handling.
+    if cfg.docking_method == 'vina':
+        write_vina_maps(cfg)
\ No newline at end of file
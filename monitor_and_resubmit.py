@@ -4,49 +4,16 @@ Created on Mon Jun  3 04:43:56 2024
 
 @author: aksha
 """
-import os 
+import os
 import sys
+import sqlite3
 import argparse
 import subprocess
-import concurrent.futures
+import config
 
-def read_config_file(filename):
-    """
-    Reads configuration settings from a file and returns them as a dictionary.
-    
-    This function opens a specified configuration file and reads its contents line by line.
-    Lines starting with a '#' are considered comments and are ignored, as are empty lines.
-    Each valid line is expected to be in the format 'key=value'. If the 'value' is a digit,
-    it is converted to an integer; otherwise, it is kept as a string.
-
-    Parameters:
-        filename (str): The path to the configuration file to be read.
-
-    Returns:
-        dict: A dictionary containing key-value pairs of configuration settings.
-              Keys are the configuration parameter names and values are the corresponding settings.
-
-    Example:
-        Assume we have a config.txt with the following content:
-            # Configuration for system
-            NUM_CPUs=10
-            USE_LOAD_BALANCER=True
-
-        Calling read_config_file("config.txt") will return:
-            {'NUM_CPUs': 10, 'USE_LOAD_BALANCER': 'True'}
-    """
-    params = {}
-    with open(filename, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith("#"):  # skip comments and empty lines
-                key, value = line.split("=", 1)
-                if value.isdigit():
-                    params[key] = int(value)
-                else:
-                    params[key] = value
-    return params
+# Shared results database written by the dataset_calc.py workers. Keep in
+# sync with RESULTS_DB in dataset_calc.py.
+RESULTS_DB = './results.db'
 
 def update_config_file(filename, num_mols, smiles_file_path):
     """
@@ -87,77 +54,70 @@ def update_config_file(filename, num_mols, smiles_file_path):
         f.writelines(updated_lines)
     print(f"Configuration file {filename} updated.")
     
-def delete_file(file_path):
-    """Helper function to delete a single file. 
-    
-    Used for cleanup of intermediate files. 
-    
-    """
-    os.remove(file_path)
-    
-def create_and_submit_job(script_name, job_part):
+def create_and_submit_array_job(script_name, job_parts):
     """
-    Creates a Slurm batch job script tailored for a specific job part and submits it for execution.
+    Resubmits all crashed job parts with a single Slurm array submission.
 
-    This function dynamically generates a batch job script with custom configurations per job part,
-    including dedicated output and error logs for each run. The script is written to the file system,
-    submitted to Slurm with the `sbatch` command, and then deleted to clean up and prevent clutter.
+    This function writes one batch job script whose body reads its partition
+    from $SLURM_ARRAY_TASK_ID, then submits it once with
+    `sbatch --array=<i,j,k>` covering every crashed part. That means one RPC
+    to the Slurm controller no matter how many parts crashed, instead of a
+    script write and an sbatch call per part. The script is deleted after
+    submission to clean up and prevent clutter.
 
     Parameters:
         script_name (str): The filename for the Slurm batch job script. This script is temporary
                            and will be deleted after submission.
-        job_part (int): The specific job part or task ID to be processed. This ID is used to
-                        specify which part of the dataset the `dataset_calc.py` script should
-                        work on, and it also influences the naming of the job and log files.
+        job_parts (list): The crashed job parts or task IDs to be resubmitted. Each ID selects
+                          which part of the dataset the `dataset_calc.py` script should work on,
+                          and the %a placeholder keys the log files to it.
 
     The generated script sets up the required environment by loading necessary modules and
     specifies resource allocations (e.g., number of tasks per node, memory per node, etc.).
-    It configures job output settings such as standard output and error files which include the
-    job part in their names for easy identification and troubleshooting.
-
-    The script directly executes a Python script (`dataset_calc.py`) with the job part as an argument,
-    which is intended to perform computations or data processing specific to that part of the overall task.
+    Standard output and error files use Slurm's %a (array task ID) placeholder so each
+    resubmitted part keeps its own logs for easy identification and troubleshooting.
 
     Examples:
-        - create_and_submit_job("resubmit_job123_part1.sh", 1)
-        This would create a job script named "resubmit_job123_part1.sh" that, when executed by Slurm,
-        runs `dataset_calc.py 1`, targeting the dataset segment partition_1.smi
+        - create_and_submit_array_job("resubmit_job123.sh", [1, 4, 7])
+        This would create one job script named "resubmit_job123.sh" and submit it with
+        `sbatch --array=1,4,7`; each array task runs `dataset_calc.py $SLURM_ARRAY_TASK_ID`,
+        targeting its dataset segment partition_<id>.smi
 
     After submission, the function ensures that the script file is immediately deleted to maintain
     a clean workspace and avoid the accumulation of temporary files.
     """
     with open(script_name, 'w') as script_file:
         script_file.write(
-            f"""#!/bin/bash
+            """#!/bin/bash
             #SBATCH --account=akshat998
             #SBATCH --ntasks-per-node=40
             #SBATCH --mem=7000M               # memory (per node)
             #SBATCH --time=12:0:00
             #SBATCH --job-name nodeTask
-            #SBATCH -e stderr_{job_part}.txt
-            #SBATCH -o stdout_{job_part}.txt
+            #SBATCH -e stderr_%a.txt
+            #SBATCH -o stdout_%a.txt
             #SBATCH --open-mode=append
             #SBATCH --export=NONE
-            
+
             module --force purge
             module load nixpkgs/16.09
             module load gcc/7.3.0
             module load rdkit/2019.03.4
             module load scipy-stack/2019b
             module load openbabel
-            
-            python3 dataset_calc.py {job_part}
+
+            python3 dataset_calc.py $SLURM_ARRAY_TASK_ID
             """)
-    subprocess.run(['sbatch', script_name])
+    array_spec = ",".join(str(part) for part in job_parts)
+    subprocess.run(['sbatch', '--array=' + array_spec, script_name])
     os.remove(script_name)
-    print(f"Job part {job_part} resubmitted and script {script_name} deleted.")
+    print(f"Job parts {array_spec} resubmitted as one array and script {script_name} deleted.")
     
 
-# Read the all.ctrl file to get parameters
-config_params = read_config_file("all.ctrl")
-
-
 if __name__ == "__main__":
+    # Read the all.ctrl file to get parameters
+    cfg = config.load()
+
     parser = argparse.ArgumentParser(description="Monitor and resubmit script")
     parser.add_argument(
         "monitor_type", 
@@ -184,16 +144,14 @@ if __name__ == "__main__":
             print('Proceeding with job analysis')
 
         completed_job_ids = {line.split()[0].split('_')[1] for line in job_info if line.strip()}
-        crashed_job_partitions = [i for i in range(1, config_params['MAX_NUM_JOBS'] + 1) if str(i) not in completed_job_ids]
+        crashed_job_partitions = [i for i in range(1, cfg.max_num_jobs + 1) if str(i) not in completed_job_ids]
 
         if not crashed_job_partitions:
             print('No crashed jobs detected. Please check again later. Exiting.')
             sys.exit()
 
         print('Detected Crashed Jobs:', [f"{args.job_id}_{idx}" for idx in crashed_job_partitions])
-        for idx in crashed_job_partitions:
-            script_name = f"resubmit_{args.job_id}_{idx}.sh"
-            create_and_submit_job(script_name, idx)
+        create_and_submit_array_job(f"resubmit_{args.job_id}.sh", crashed_job_partitions)
                 
     elif args.monitor_type == "finish_and_resubmit":
         # Check for currently running jobs using the job ID.
@@ -205,36 +163,52 @@ if __name__ == "__main__":
 
         print("All jobs have finished, proceeding with analysis.")
 
-        # Combine output files into a single file for analysis and remove the originals.
-        output_files = [file for file in os.listdir(".") if file.startswith("OUTPUT_") and file.endswith(".txt")]
-        if output_files:
-            with open("DATA/combined_output.txt", "w") as combined_file:
-                for file in output_files:
-                    with open(file, "r") as f:
-                        combined_file.write(f.read())
-                    os.remove(file)
-            print("Output files combined and original files deleted.")
-
-        # Delete all intermediate .pdbqt files in parallel to clean up the workspace.
-        pdbqt_files = [os.path.join(".", file) for file in os.listdir(".") if file.endswith(".pdbqt")]
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            executor.map(delete_file, pdbqt_files)
+        # Export the scores from the shared results database into a single
+        # file for analysis (the workers write straight to SQLite, so there
+        # are no per-job output files left to concatenate). Rows are fetched
+        # and written in fixed-size batches so memory use stays bounded no
+        # matter how large the screen was.
+        conn = sqlite3.connect(RESULTS_DB)
+        conn.execute('CREATE TABLE IF NOT EXISTS scores (smi TEXT PRIMARY KEY, score REAL, job INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS prefiltered (smi TEXT PRIMARY KEY, reason TEXT)')
+        cursor = conn.execute('SELECT smi, score FROM scores')
+        with open("DATA/combined_output.txt", "w") as combined_file:
+            while True:
+                rows = cursor.fetchmany(65536)
+                if not rows:
+                    break
+                combined_file.writelines(f'{smi}, {score}\n' for smi, score in rows)
+        print("Docking scores exported to DATA/combined_output.txt.")
+
+        # Delete any stray intermediate .pdbqt files to clean up the
+        # workspace. os.scandir hands back the name and path in one pass,
+        # and os.remove is a single syscall, so a thread pool only adds
+        # startup and GIL overhead here.
+        with os.scandir(".") as it:
+            for entry in it:
+                if entry.name.endswith(".pdbqt"):
+                    os.unlink(entry.path)
         print("Cleanup completed. Intermediate PDBQT files deleted.")
 
-        # Similarly, delete all SMI partition files in the ./DATA directory in parallel.
-        smi_files = [os.path.join("./DATA", file) for file in os.listdir("./DATA") if file.startswith("partition_") and file.endswith(".smi")]
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            executor.map(delete_file, smi_files)
+        # Similarly, delete all SMI partition files in the ./DATA directory.
+        with os.scandir("./DATA") as it:
+            for entry in it:
+                if entry.name.startswith("partition_") and entry.name.endswith(".smi"):
+                    os.unlink(entry.path)
         print("SMI partition files deleted.")
 
-        # Identify incomplete molecules from the combined output.
-        with open("DATA/combined_output.txt", 'r') as f:
-            all_molecules = f.readlines()
-        with open(config_params['SMILES_FILES'], 'r') as f:
-            completed_mols = f.readlines()
-        completed_mols = {molecule.split(',')[0].strip(): i for i, molecule in enumerate(completed_mols)}
-
-        incomplete_calculations = [item+'\n' for item in all_molecules if item not in completed_mols]
+        # Identify incomplete molecules: everything requested in the input
+        # SMILES file minus everything already scored or rejected by the
+        # descriptor prefilter. Both sides are stripped SMILES strings, so
+        # this is a plain set difference (which also drops blank lines and
+        # duplicate entries).
+        done = {row[0] for row in
+                conn.execute('SELECT smi FROM scores UNION SELECT smi FROM prefiltered')}
+        conn.close()
+        with open(cfg.smiles_file, 'r') as f:
+            all_needed = {line.strip() for line in f if line.strip()}
+
+        incomplete_calculations = [smi + '\n' for smi in sorted(all_needed - done)]
         NUM_MISSING_MOLS = len(incomplete_calculations)
         print(f'Total number of incomplete molecules: {NUM_MISSING_MOLS}')
 